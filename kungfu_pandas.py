@@ -1,7 +1,35 @@
 import pandas as pd
 import numpy as np
 from typing import List
-import time, os, h5py
+import time, os, h5py, atexit, pickle
+from contextlib import contextmanager
+
+try:
+    # Registers the blosc/bitshuffle filters with h5py
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+# Appended data is kept in memory until `flush` is called. Keys are (filepath, h5_key), values are lists of DataFrames 
+# for sweeps and lists of dictionaries for dictionaries.
+_pending = {}
+_pending_dicts = {}
+# Buffered data of keys that could not be written by `flush`, with the same keys and values as above
+_failed = {}
+# Compression of buffered keys, used by `flush` when it creates the table. Values are (complib, complevel).
+_compression = {}
+
+# Target size of a single write to the h5 file
+_CHUNK_BYTES = 1_048_576
+
+# Buffered data of a key is flushed automatically after this many appends or buffered values, to limit what is lost in a crash
+_FLUSH_APPENDS = 100
+_FLUSH_VALUES = _CHUNK_BYTES // 8
 
 def create_path_filename(measurement_name: str, path: str = None):
     """Creates a filename with date and timestamp.
@@ -25,9 +53,14 @@ def create_path_filename(measurement_name: str, path: str = None):
     return filepath
 
 def save_nd_sweep(filepath: str, data_array : np.ndarray, index_arrays: list, data_column_names: list, index_names: list, 
-                  h5_key: str = "ndsweep"):
+                  h5_key: str = "ndsweep", compression: str = "blosc:lz4", complevel: int = 3, backend: str = "h5"):
     """Save a multi-dimensional sweep where all data is already available. For saving the data piecewise as it is being recorded, see `append_2d_sweep`
     This function is suitable if each quantity has a single value at each sweep point, e.g. the magnitude at a single frequency vs. two voltage values.
+    Data is compressed by default, since sweep data compresses well and writing to a network drive is much slower than compressing.
+    Each data column and sweep axis is stored as its own dataset under h5_key, such that a single quantity can be read 
+    without loading the others. Use `open_file` to read the data back as a DataFrame.
+    With backend = 'zarr' the data is saved in a zarr store next to filepath, with a .zarr extension instead. Zarr 
+    compresses every chunk in a separate file, which is faster for large sweeps and works better on network drives.
     
     Some things to remember: 
     - data_array is a list of data. data_array.shape = n x m
@@ -43,32 +76,51 @@ def save_nd_sweep(filepath: str, data_array : np.ndarray, index_arrays: list, da
         data_column_names (list): The names of the quantities being recorded, e.g. magnitude and phase of a signal
         index_names (list): Names of the sweep axes (e.g. which voltages are swept)
         h5_key (str, optional): h5 key. Defaults to "ndsweep".
+        compression (str, optional): Compression library. "blosc:<compressor>" uses blosc with bitshuffle if hdf5plugin is 
+        installed, "zlib" uses gzip, anything else falls back to lzf. Defaults to "blosc:lz4".
+        complevel (int, optional): Compression level between 0 and 9, use 0 to disable compression. Defaults to 3.
+        backend (str, optional): 'h5' or 'zarr'. Defaults to 'h5'.
 
     Returns:
         _type_: None
     """
+    # No copy of the whole array: every column is copied once, when it is written to its own dataset
+    data_array = np.asarray(data_array)
+    
     # Checks for consistency:
     n, m = np.shape(data_array)
     
     assert len(data_column_names) == m
     assert len(index_names) == len(index_arrays)
+    assert np.prod([len(np.atleast_1d(index_array)) for index_array in index_arrays]) == n
+    assert backend in ("h5", "zarr")
     
-    df = pd.DataFrame(data_array, 
-                      index=pd.MultiIndex.from_product(index_arrays, names=index_names), 
-                      columns=data_column_names)
+    if backend == "zarr":
+        filepath = _zarr_path(filepath)
+        filters = _zarr_compressors(compression, complevel)
+    else:
+        filters = _h5py_filters(compression, complevel)
     
-    keys = get_keys(filepath)
+    flush(filepath)
     
-    if h5_key in keys:
-        print("h5_key already exists, data not saved!")
-    else:
-        df.to_hdf(filepath, key=h5_key, mode='a')
+    # Check for the key and write the data with a single open file handle
+    with with_file(filepath, mode='a') as f:
+        if h5_key in get_keys(filepath, f):
+            print("h5_key already exists, data not saved!")
+        else:
+            _write_columns(f.create_group(h5_key), data_array, index_arrays, data_column_names, index_names, **filters)
     
     return None
 
 def append_nd_sweep(filepath: str, data_array : np.ndarray, index_arrays: list, data_column_names: list, index_names: list, 
-                    h5_key: str = "2dsweep"):
+                    h5_key: str = "2dsweep", compact: bool = False, compression: str = "blosc:lz4", complevel: int = 3, 
+                    backend: str = "h5"):
     """Build a multi-dimensional pandas dataframe as data comes in. This method can be used for 1d, 2d and arbitrary dimensional sweeps.
+    Appended data is buffered in memory and written to the file in one go by `flush`. This happens automatically every 
+    100 appends or 1 MB of data, when the file is read with `open_file` or `get_keys`, and when Python exits.
+    If a key has to be rewritten, the old data is left as unused space in the file. Set compact=True on the last append 
+    of a sweep to reclaim this space once, see `compact_file`.
+    With backend = 'zarr' the data is appended to a zarr store next to filepath, see `save_nd_sweep`.
 
     Args:
         filepath (str): Filepath with h5 extension.
@@ -77,32 +129,689 @@ def append_nd_sweep(filepath: str, data_array : np.ndarray, index_arrays: list,
         data_column_names (list): The names of the quantities being recorded, e.g. magnitude and phase of a signal
         index_names (list): Names of the sweep axes (e.g. which voltages are swept)
         h5_key (str, optional): h5 key. Defaults to "2dsweep".
+        compact (bool, optional): Flush and compact the file after appending. Zarr stores are only flushed. Defaults to False.
+        compression (str, optional): Compression library, any complib supported by pandas. For backend = 'zarr', see 
+        `save_nd_sweep`. This is only used when the key is created. Defaults to "blosc:lz4".
+        complevel (int, optional): Compression level between 0 and 9, use 0 to disable compression. Defaults to 3.
+        backend (str, optional): 'h5' or 'zarr'. Defaults to 'h5'.
 
     Returns:
         _type_: None
+
+    Raises:
+        ValueError: If data_column_names differ from the columns of earlier appends or of the saved key. Columns are 
+        matched by name, so they may be given in a different order.
     """
+    assert backend in ("h5", "zarr")
     
-    keys = get_keys(filepath)
-    existing_df = open_file(filepath, h5_key)
+    if backend == "zarr":
+        filepath = _zarr_path(filepath)
     
     df = pd.DataFrame(data_array, 
-                        index=pd.MultiIndex.from_product(index_arrays, names=index_names), 
+                        index=_fast_product_index(index_arrays, index_names), 
                         columns=data_column_names)
+    
+    # Checked here rather than in flush, such that a mismatch fails at the append that caused it. The file is only 
+    # opened for the first append after a flush.
+    frames = _pending.get((filepath, h5_key))
+    columns = list(frames[0].columns) if frames else _stored_columns(filepath, h5_key)
+    if columns is not None:
+        names = {str(name): name for name in df.columns}
+        if set(names) != {str(name) for name in columns}:
+            raise ValueError(f"Columns {list(df.columns)} do not match the columns {list(columns)} of h5_key {h5_key}.")
+        df = df[[names[str(name)] for name in columns]]
+    
+    frames = _pending.setdefault((filepath, h5_key), [])
+    frames.append(df)
+    _compression[(filepath, h5_key)] = (compression, complevel)
+    
+    if compact or len(frames) >= _FLUSH_APPENDS or sum(frame.size for frame in frames) >= _FLUSH_VALUES:
+        flush(filepath)
+    
+    if compact:
+        if backend == "h5":
+            compact_file(filepath)
+    
+    return None
 
-    if h5_key in keys:
-        # The key already exists, we can append to it
-        new_df = pd.concat([existing_df, df])
-        new_df.sort_index()
-        new_df.to_hdf(filepath, key=h5_key, mode='a')
+def _stored_columns(filepath: str, h5_key: str):
+    """Names of the data columns of a sweep saved in filepath.
+
+    Args:
+        filepath (str): Filepath with h5 or zarr extension.
+        h5_key (str): h5 key
+
+    Returns:
+        list: Column names, or None if the key does not exist.
+
+    Raises:
+        ValueError: If the key was saved by `save_dict`.
+    """
+    with with_file(filepath) as f:
+        if f is None or h5_key not in f:
+            return None
+        elif f[h5_key].attrs.get("layout") == "columns":
+            return list(f[h5_key].attrs["columns"])
+        elif "layout" in f[h5_key].attrs:
+            raise ValueError(f"h5_key {h5_key} was saved by save_dict!")
+    
+    with pd.HDFStore(filepath, mode='r') as store:
+        return list(store.select(h5_key, stop=0).columns)
+
+def flush(filepath: str = None):
+    """Write all buffered appends to disk. Sweep data is stored in the appendable 'table' format, such that only the new 
+    rows are written. Keys that cannot be appended to (e.g. keys saved in the 'fixed' format, or strings that are longer 
+    than before) are read and rewritten once as a table. Sweeps saved with `save_nd_sweep` are extended column by 
+    column instead, see `_append_rows`. Dictionaries are added as new entries, see `save_dict`. Dictionaries saved as 
+    a DataFrame by older versions are converted to entries first.
+    Every key is written separately. If a key cannot be written, a message is printed and its buffered data is moved to 
+    `_failed`, while the other keys are still written.
+
+    Args:
+        filepath (str, optional): Filepath with h5 extension. If None, all files with buffered data are flushed. Defaults to None.
+    """
+    files = {fp for (fp, _) in list(_pending) + list(_pending_dicts) if filepath is None or fp == filepath}
+    
+    for fp in files:
+        sweep_keys = [k for (f, k) in _pending if f == fp]
+        dict_keys = [k for (f, k) in _pending_dicts if f == fp]
         
+        # All sweeps of a file are written with a single open file handle
+        if sweep_keys and _is_zarr(fp):
+            with with_file(fp, mode='a') as f:
+                for h5_key in sweep_keys:
+                    try:
+                        df = pd.concat(_pending[(fp, h5_key)])
+                        _append_rows(f.require_group(h5_key), df, 
+                                     **_zarr_compressors(*_compression.get((fp, h5_key), ("blosc:lz4", 3))))
+                    except Exception as error:
+                        _set_aside(fp, h5_key, _pending, error)
+                        continue
+                    del _pending[(fp, h5_key)]
+                    _compression.pop((fp, h5_key), None)
+        elif sweep_keys:
+            # Keys that are not pandas tables must not get a table node
+            with with_file(fp, mode='a') as f:
+                for h5_key in [k for k in sweep_keys if k in f and "layout" in f[k].attrs]:
+                    if f[h5_key].attrs["layout"] != "columns":
+                        print(f"h5_key {h5_key} was saved by save_dict, data not saved!")
+                    else:
+                        try:
+                            _append_rows(f[h5_key], pd.concat(_pending[(fp, h5_key)]), 
+                                         **_h5py_filters(*_compression.get((fp, h5_key), ("blosc:lz4", 3))))
+                        except Exception as error:
+                            _set_aside(fp, h5_key, _pending, error)
+                            continue
+                    del _pending[(fp, h5_key)]
+                    _compression.pop((fp, h5_key), None)
+            
+            table_keys = [k for k in sweep_keys if (fp, k) in _pending]
+            if table_keys:
+                with pd.HDFStore(fp, mode='a') as store:
+                    for h5_key in table_keys:
+                        try:
+                            _append_table(store, h5_key, pd.concat(_pending[(fp, h5_key)]), 
+                                          *_compression.get((fp, h5_key), ("blosc:lz4", 3)))
+                        except Exception as error:
+                            _set_aside(fp, h5_key, _pending, error)
+                            continue
+                        del _pending[(fp, h5_key)]
+                        _compression.pop((fp, h5_key), None)
+        
+        # The same for all dictionaries. Dictionaries saved as a pandas DataFrame by older versions are read first and 
+        # converted to entries once.
+        if dict_keys:
+            with with_file(fp) as f:
+                legacy_keys = [k for k in dict_keys if f is not None and k in f and "pandas_type" in f[k].attrs]
+            legacy = {}
+            if legacy_keys:
+                with pd.HDFStore(fp, mode='r') as store:
+                    for h5_key in legacy_keys:
+                        try:
+                            legacy[h5_key] = store[h5_key].to_dict("records")
+                        except Exception as error:
+                            _set_aside(fp, h5_key, _pending_dicts, error)
+            
+            with with_file(fp, mode='a') as f:
+                for h5_key in [k for k in dict_keys if (fp, k) in _pending_dicts]:
+                    records = _pending_dicts[(fp, h5_key)]
+                    try:
+                        if h5_key in legacy:
+                            _convert_legacy_dict(f, h5_key, legacy[h5_key])
+                        elif h5_key not in f:
+                            f.create_group(h5_key).attrs["layout"] = "dict"
+                        elif f[h5_key].attrs.get("layout") != "dict":
+                            print(f"h5_key {h5_key} was not saved by save_dict, data not saved!")
+                            del _pending_dicts[(fp, h5_key)]
+                            continue
+                        # Remove every record as soon as it is written, such that a failure does not write records twice
+                        while records:
+                            _append_entry(f[h5_key], records[0])
+                            del records[0]
+                    except Exception as error:
+                        _set_aside(fp, h5_key, _pending_dicts, error)
+                        continue
+                    del _pending_dicts[(fp, h5_key)]
+
+def _append_table(store: pd.HDFStore, h5_key: str, df: pd.DataFrame, complib: str, complevel: int):
+    """Appends df to a key in the 'table' format. Keys that cannot be appended to are read and rewritten once, see `flush`.
+
+    Args:
+        store (pd.HDFStore): Store opened for appending
+        h5_key (str): h5 key
+        df (pd.DataFrame): Rows to append
+        complib (str): Compression library, any complib supported by pandas.
+        complevel (int): Compression level between 0 and 9.
+    """
+    chunksize = _chunk_rows(*df.shape, max(_itemsize(d) for d in df.dtypes))
+    index_dtypes = df.index.dtypes if isinstance(df.index, pd.MultiIndex) else [df.index.dtype]
+    expectedrows = _expected_rows(sum(_itemsize(d) for d in [*df.dtypes, *index_dtypes]))
+    try:
+        store.append(h5_key, df, format='table', data_columns=None, index=False, complib=complib, 
+                     complevel=complevel, chunksize=chunksize, expectedrows=expectedrows)
+    except (ValueError, TypeError):
+        # Rewritten with append rather than put, since put does not take expectedrows
+        new_df = pd.concat([store[h5_key], df])
+        store.remove(h5_key)
+        store.append(h5_key, new_df, format='table', data_columns=None, index=False, complib=complib, 
+                     complevel=complevel, chunksize=chunksize, expectedrows=expectedrows)
+
+def _convert_legacy_dict(f: h5py.File, h5_key: str, records: list):
+    """Replaces a dictionary saved as a pandas DataFrame by older versions with the entries of `save_dict`.
+
+    Args:
+        f (h5py.File): File opened for appending
+        h5_key (str): h5 key of the dictionary
+        records (list): Rows of the old DataFrame as dictionaries
+    """
+    # Write the converted entries next to the old key, such that a failure leaves the old key intact
+    if f"{h5_key}_converted" in f:
+        del f[f"{h5_key}_converted"]
+    group = f.create_group(f"{h5_key}_converted")
+    group.attrs["layout"] = "dict"
+    for record in records:
+        _append_entry(group, _to_attrs(record))
+    del f[h5_key]
+    f.move(group.name, h5_key)
+
+def _set_aside(filepath: str, h5_key: str, buffer: dict, error: Exception):
+    """Moves the buffered data of a key that could not be written to `_failed`, such that it does not block the other 
+    keys of the file and every later flush.
+
+    Args:
+        filepath (str): Filepath of the key
+        h5_key (str): h5 key
+        buffer (dict): `_pending` or `_pending_dicts`
+        error (Exception): Error raised while writing the key
+    """
+    _failed.setdefault((filepath, h5_key), []).extend(buffer.pop((filepath, h5_key)))
+    if buffer is _pending:
+        _compression.pop((filepath, h5_key), None)
+    print(f"h5_key {h5_key} could not be written to {filepath} ({type(error).__name__}: {error}), data not saved! "
+          f"The buffered data is kept in kungfu_pandas._failed[{(filepath, h5_key)!r}].")
+
+atexit.register(flush)
+
+def _h5py_filters(compression: str, complevel: int):
+    """Translates a pandas style complib and complevel to h5py dataset options.
+
+    Args:
+        compression (str): Compression library, e.g. "blosc:lz4".
+        complevel (int): Compression level between 0 and 9. Use 0 to disable compression.
+
+    Returns:
+        dict: Keyword arguments for `create_dataset`.
+    """
+    library, _, compressor = compression.partition(":")
+    
+    if not complevel:
+        return {}
+    elif library == "blosc" and hdf5plugin is not None:
+        return {"compression": hdf5plugin.Blosc(cname=compressor or "blosclz", clevel=complevel, 
+                                                shuffle=hdf5plugin.Blosc.BITSHUFFLE)}
+    elif library == "zlib":
+        return {"compression": "gzip", "compression_opts": complevel, "shuffle": True}
+    else:
+        return {"compression": "lzf", "shuffle": True}
+
+def _zarr_compressors(compression: str, complevel: int):
+    """Translates a pandas style complib and complevel to zarr array options, see `_h5py_filters`.
+
+    Args:
+        compression (str): Compression library, e.g. "blosc:lz4".
+        complevel (int): Compression level between 0 and 9. Use 0 to disable compression.
+
+    Returns:
+        dict: Keyword arguments for `create_array`.
+    """
+    library, _, compressor = compression.partition(":")
+    
+    if not complevel:
+        return {"compressors": None}
+    elif library == "blosc":
+        return {"compressors": zarr.codecs.BloscCodec(cname=compressor or "blosclz", clevel=complevel, shuffle="bitshuffle")}
+    elif library == "zlib":
+        return {"compressors": zarr.codecs.GzipCodec(level=complevel)}
     else:
-        # This is the first time we access the key, no need to append.
-        df.to_hdf(filepath, key=h5_key, mode='a')
+        return {}
+
+def _zarr_path(filepath: str):
+    """Path of the zarr store that is used instead of an h5 file for backend = 'zarr'.
+
+    Args:
+        filepath (str): Filepath with h5 extension.
+
+    Returns:
+        str: Filepath with zarr extension.
     
-    return None
+    Raises:
+        ImportError: If zarr is not installed. This is checked here, such that appends fail immediately instead of in `flush`.
+    """
+    if zarr is None:
+        raise ImportError("The zarr package is required for zarr stores.")
+    return os.path.splitext(filepath)[0] + ".zarr"
+
+def _is_zarr(filepath: str):
+    """Checks if filepath is a zarr store rather than an h5 file.
+
+    Args:
+        filepath (str): Filepath with h5 or zarr extension.
+
+    Returns:
+        bool: True for a zarr store.
+    """
+    return os.path.splitext(filepath)[1] == ".zarr"
+
+def _write_array(group, name: str, array: np.ndarray, **kwargs):
+    """Creates a resizable 1d dataset in group. Strings are stored as variable length strings, since neither h5py nor 
+    zarr can append to numpy's fixed length unicode dtype.
+
+    Args:
+        group (h5py.Group or zarr.Group): Group in which the dataset is created.
+        name (str): Name of the dataset
+        array (np.ndarray): Data of the dataset
+        kwargs: Passed to `create_dataset` (h5py) or `create_array` (zarr), e.g. chunks and compression.
+    """
+    array = np.asarray(array)
+    
+    if isinstance(group, h5py.Group) and array.dtype.kind in "UO":
+        group.create_dataset(name, data=array.astype(object), dtype=h5py.string_dtype(), maxshape=(None,), **kwargs)
+    elif isinstance(group, h5py.Group):
+        group.create_dataset(name, data=array, maxshape=(None,), **kwargs)
+    elif array.dtype.kind in "UOT":
+        group.create_array(name, shape=array.shape, dtype=str, **kwargs)[...] = array.astype(object)
+    else:
+        group.create_array(name, data=array, **kwargs)
+
+def _extend_array(group, name: str, array: np.ndarray, **kwargs):
+    """Appends to a 1d dataset written by `_write_array`.
+
+    Args:
+        group (h5py.Group or zarr.Group): Group of the dataset
+        name (str): Name of the dataset
+        array (np.ndarray): Data to append, converted with `_as_dtype`
+        kwargs: Passed to `_write_array` if the dataset has to be rewritten.
+    """
+    dataset = group[name]
+    
+    if isinstance(dataset, h5py.Dataset) and dataset.maxshape[0] is None:
+        n = dataset.shape[0]
+        dataset.resize((n + len(array),))
+        dataset[n:] = array
+    elif isinstance(dataset, h5py.Dataset):
+        # Datasets that were not created resizable are rewritten once
+        array = np.concatenate([_read_array(dataset), array])
+        del group[name]
+        _write_array(group, name, array, **kwargs)
+    else:
+        dataset.append(array)
+
+def _as_dtype(dataset, array: np.ndarray):
+    """Converts data to the dtype of a dataset written by `_write_array`, before anything is appended.
+
+    Args:
+        dataset (h5py.Dataset or zarr.Array): Dataset to append to
+        array (np.ndarray): Data to append
+
+    Returns:
+        np.ndarray: Data with the dtype of the dataset.
+
+    Raises:
+        TypeError: If the data cannot be safely converted, e.g. strings to float.
+    """
+    array = np.asarray(array)
+    if dataset.dtype.kind in "OT":
+        return array.astype(object)
+    return array.astype(dataset.dtype, casting="same_kind")
+
+def _read_array(dataset):
+    """Reads a dataset written by `_write_array`.
+
+    Args:
+        dataset (h5py.Dataset or zarr.Array): Dataset to read
+
+    Returns:
+        np.ndarray: Data of the dataset
+    """
+    if isinstance(dataset, h5py.Dataset) and h5py.check_string_dtype(dataset.dtype) is not None:
+        return dataset.asstr()[()]
+    elif isinstance(dataset, h5py.Dataset):
+        return dataset[()]
+    
+    array = dataset[...]
+    return array.astype(object) if array.dtype.kind == "T" else array
+
+def _write_columns(group, data_array: np.ndarray, index_arrays: list, data_column_names: list, index_names: list, **kwargs):
+    """Writes a sweep to group with one dataset per data column. The sweep axes are saved in the subgroup _index.
+
+    Args:
+        group (h5py.Group or zarr.Group): Empty group for the sweep
+        data_array (np.ndarray): Data array with dimensions n x m
+        index_arrays (list): List of index arrays, or floats if a voltage is constant. These are the sweep axes values.
+        data_column_names (list): The names of the quantities being recorded
+        index_names (list): Names of the sweep axes
+        kwargs: Passed to `create_dataset` for the data columns, e.g. compression.
+    """
+    n, m = np.shape(data_array)
+    chunk_rows = _chunk_rows(n, 1, data_array.itemsize)
+    
+    group.attrs["layout"] = "columns"
+    group.attrs["index"] = "product"
+    group.attrs["columns"] = [str(name) for name in data_column_names]
+    group.attrs["index_names"] = [str(name) for name in index_names]
+    
+    for j, name in enumerate(group.attrs["columns"]):
+        _write_array(group, name, data_array[:, j], chunks=(chunk_rows,), **kwargs)
+    
+    index_group = group.create_group("_index")
+    for name, index_array in zip(group.attrs["index_names"], index_arrays):
+        _write_array(index_group, name, np.atleast_1d(index_array))
+
+def _append_rows(group, df: pd.DataFrame, **kwargs):
+    """Appends the rows of df to a group with one dataset per data column. Unlike `_write_columns`, the index is not 
+    a product of the sweep axes, so the index values of every row are saved in the subgroup _index. The product index 
+    of a sweep saved by `_write_columns` is expanded to one value per row on the first append.
+
+    Args:
+        group (h5py.Group or zarr.Group): Group of the sweep, empty if this is the first append.
+        df (pd.DataFrame): Rows to append
+        kwargs: Passed to `create_dataset` (h5py) or `create_array` (zarr) for the data columns, e.g. compression. 
+        The columns of df are matched to the columns of the sweep by name, see `append_nd_sweep`.
+    """
+    index_arrays = [df.index.get_level_values(k).to_numpy() for k in range(df.index.nlevels)]
+    
+    if "layout" not in group.attrs:
+        group.attrs.update(layout="columns", index="rows", columns=[str(name) for name in df.columns], 
+                           index_names=[str(name) for name in df.index.names])
+        for name, column in zip(group.attrs["columns"], df.columns):
+            values = df[column].to_numpy()
+            _write_array(group, name, values, chunks=(_CHUNK_BYTES // values.itemsize,), **kwargs)
+        
+        index_group = group.create_group("_index")
+        for name, values in zip(group.attrs["index_names"], index_arrays):
+            _write_array(index_group, name, values, chunks=(_CHUNK_BYTES // values.itemsize,))
+    else:
+        df = df.set_axis([str(column) for column in df.columns], axis=1)
+        if group.attrs.get("index", "product") == "product":
+            index = _read_columns(group, columns=[]).index
+            del group["_index"]
+            group.attrs["index"] = "rows"
+            index_group = group.create_group("_index")
+            for k, name in enumerate(group.attrs["index_names"]):
+                values = index.get_level_values(k).to_numpy()
+                _write_array(index_group, name, values, chunks=(_CHUNK_BYTES // values.itemsize,))
+        
+        # Convert everything first, such that a wrong dtype does not leave some of the datasets extended
+        columns = [(group, name, _as_dtype(group[name], df[name].to_numpy())) for name in group.attrs["columns"]]
+        columns += [(group["_index"], name, _as_dtype(group["_index"][name], values)) 
+                    for name, values in zip(group.attrs["index_names"], index_arrays)]
+        for parent, name, values in columns:
+            _extend_array(parent, name, values, chunks=(_CHUNK_BYTES // values.itemsize,), 
+                          **(kwargs if parent is group else {}))
+
+def _read_columns(group, columns: list = None):
+    """Reads a sweep written by `_write_columns` or `_append_rows` into a DataFrame.
+
+    Args:
+        group (h5py.Group or zarr.Group): Group of the sweep
+        columns (list, optional): Names of the data columns to read. If None, all columns are read. Defaults to None.
+
+    Returns:
+        Dataframe Object: Pandas DataFrame object
+    """
+    columns = list(group.attrs["columns"]) if columns is None else columns
+    index_names = list(group.attrs["index_names"])
+    index_arrays = [_read_array(group["_index"][name]) for name in index_names]
+    
+    if group.attrs.get("index", "product") == "rows":
+        index = pd.MultiIndex.from_arrays(index_arrays, names=index_names)
+        index = index.get_level_values(0) if index.nlevels == 1 else index
+    else:
+        index = _fast_product_index(index_arrays, index_names)
+    
+    return pd.DataFrame({name: _read_array(group[name]) for name in columns}, index=index)
+
+def _fast_product_index(index_arrays: list, index_names: list):
+    """Builds the index of a sweep from the sweep axes. This is equivalent to `pd.MultiIndex.from_product`, but builds the 
+    codes directly with `np.repeat` and `np.tile` and skips the integrity checks, which matters since it is called for every append.
+    1d and 2d sweeps, the most common cases, are handled without the general product loop.
+
+    Args:
+        index_arrays (list): List of index arrays, or floats if a voltage is constant. These are the sweep axes values.
+        index_names (list): Names of the sweep axes
+
+    Returns:
+        pd.Index: MultiIndex, or a regular Index for a 1d sweep since tables do not support a MultiIndex with a single level.
+    """
+    if len(index_arrays) == 1:
+        # No product to take, the index is the sweep axis itself
+        return pd.Index(np.atleast_1d(index_arrays[0]), name=index_names[0])
+    
+    levels, level_codes = [], []
+    for index_array in index_arrays:
+        codes, level = pd.factorize(np.atleast_1d(index_array), sort=True)
+        levels.append(level)
+        level_codes.append(codes)
+    
+    sizes = [len(codes) for codes in level_codes]
+    if len(sizes) == 2:
+        codes = [np.repeat(level_codes[0], sizes[1]), np.tile(level_codes[1], sizes[0])]
+    else:
+        codes = [np.tile(np.repeat(c, np.prod(sizes[k+1:], dtype=int)), np.prod(sizes[:k], dtype=int)) 
+                 for k, c in enumerate(level_codes)]
+    
+    # If all sweep axes are increasing, the index is lexsorted and pandas does not have to check this
+    is_sorted = all(np.all(np.diff(c) > 0) for c in level_codes)
+    
+    return pd.MultiIndex(levels=levels, codes=codes, names=index_names, 
+                         sortorder=len(levels) if is_sorted else None, verify_integrity=False)
+
+def _chunk_rows(n: int, m: int, itemsize: int):
+    """Number of rows of an n x m array that fit in a ~1 MB chunk.
+
+    Args:
+        n (int): Number of rows
+        m (int): Number of columns
+        itemsize (int): Size of a single element in bytes
+
+    Returns:
+        int: Number of rows per chunk, between 1 and n.
+    """
+    return max(1, min(n, _CHUNK_BYTES // (m * itemsize)))
+
+def _expected_rows(rowsize: int):
+    """Number of expected rows for which PyTables gives a new table ~1 MB chunks. PyTables derives the chunk size of a 
+    table from its expected size in MB: 64 KB for tables up to 10 MB, doubling for every factor 10 beyond that.
+
+    Args:
+        rowsize (int): Size of a single table row in bytes
+
+    Returns:
+        int: Number of expected rows.
+    """
+    zone = int(np.log2(_CHUNK_BYTES // 65_536))
+    return 10**zone * 1_048_576 // rowsize
+
+def _itemsize(dtype):
+    """Size of a single element of dtype in bytes. pandas extension dtypes (e.g. strings) have no fixed size and count 
+    as 8 bytes.
+
+    Args:
+        dtype (_type_): numpy or pandas dtype
+
+    Returns:
+        int: Size of a single element in bytes.
+    """
+    try:
+        return np.dtype(dtype).itemsize
+    except TypeError:
+        return 8
+
+def compact_file(filepath: str, dest: str = None):
+    """Reclaim the unused space that is left behind in an h5 file when keys are rewritten. HDF5 does not free this space 
+    by itself, so the file keeps growing during a sweep. This copies all keys to a new file and replaces the original.
+    The copy is done by HDF5 itself, chunk by chunk, so the data is never loaded into memory. `ptrepack` is not used, 
+    since it rewrites the attributes of keys saved by `save_nd_sweep`. Only call this once, when the sweep is finished.
+    
+    If dest is given, the keys are copied to dest instead and filepath is left untouched. This way a sweep can be 
+    recorded in a local file and consolidated on a (slow) network drive once it is finished. Several files can be 
+    consolidated into the same dest, keys that already exist in dest are not copied.
+
+    Args:
+        filepath (str): Filepath with h5 extension.
+        dest (str, optional): Filepath with h5 extension to copy the keys to. If None, filepath is compacted in place. Defaults to None.
+    """
+    flush(filepath)
+    
+    root, ext = os.path.splitext(filepath)
+    temp_filepath = root + "_temp" + ext if dest is None else dest
     
+    with with_file(filepath) as src, with_file(temp_filepath, mode='w' if dest is None else 'a') as dst:
+        dst.attrs.update(src.attrs)
+        dest_keys = get_keys(temp_filepath, dst)
+        for key in get_keys(filepath, src):
+            if key in dest_keys:
+                print(f"h5_key {key} already exists in {dest}, data not copied!")
+            else:
+                src.copy(src[key], dst, name=key)
+    
+    if dest is None:
+        os.replace(temp_filepath, filepath)
+
+class StreamingWriter:
+    """Writes a sweep row by row as it is being recorded, for acquisition loops where the overhead of `append_nd_sweep` 
+    per data point matters. The file is opened once and the data columns are created as resizable datasets, in the same 
+    layout as `save_nd_sweep`. Rows and their index values are collected in a buffer of buffer_rows rows, which is 
+    written to disk in one go. Written rows are flushed to disk at least once per second, so if the writer is never 
+    closed, everything up to the last full buffer before that can still be read.
+    The file is kept open until `close` is called, so do not use the other functions on the same file in the meantime.
+    
+    Example:
+        with StreamingWriter(filepath, ["magnitude", "phase"], ["x1", "x2"], h5_key="stream") as writer:
+            for X1 in x1:
+                for X2 in x2:
+                    writer.write_row([mag, phase], (X1, X2))
+    """
+    def __init__(self, filepath: str, data_column_names: list, index_names: list, h5_key: str = "stream", 
+                 compression: str = "blosc:lz4", complevel: int = 3, buffer_rows: int = 1024, dtype=np.float64, 
+                 index_dtype=np.float64):
+        """Creates h5_key in filepath and opens it for writing.
+
+        Args:
+            filepath (str): Filepath with h5 extension.
+            data_column_names (list): The names of the quantities being recorded, e.g. magnitude and phase of a signal
+            index_names (list): Names of the sweep axes (e.g. which voltages are swept)
+            h5_key (str, optional): h5 key. Defaults to "stream".
+            compression (str, optional): Compression library, see `save_nd_sweep`. Defaults to "blosc:lz4".
+            complevel (int, optional): Compression level between 0 and 9, use 0 to disable compression. Defaults to 3.
+            buffer_rows (int, optional): Number of rows that are written to disk at once. Defaults to 1024.
+            dtype (optional): Data type of the data columns. Defaults to np.float64.
+            index_dtype (optional): Data type of the sweep axes, use str for labels. Defaults to np.float64.
+
+        Raises:
+            ValueError: If h5_key already exists in filepath.
+        """
+        flush(filepath)
+        
+        self._file = h5py.File(filepath, 'a')
+        if h5_key in self._file:
+            self._file.close()
+            raise ValueError(f"h5_key {h5_key} already exists!")
+        
+        index_dtype = h5py.string_dtype() if index_dtype is str else np.dtype(index_dtype)
+        try:
+            self._group = self._file.create_group(h5_key)
+            self._group.attrs["layout"] = "columns"
+            self._group.attrs["index"] = "rows"
+            self._group.attrs["columns"] = [str(name) for name in data_column_names]
+            self._group.attrs["index_names"] = [str(name) for name in index_names]
+            
+            # ~1 MB chunks like the other datasets, filled by several buffers
+            self._datasets = [self._group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype, 
+                                                         chunks=(_CHUNK_BYTES // np.dtype(dtype).itemsize,), 
+                                                         **_h5py_filters(compression, complevel)) 
+                              for name in self._group.attrs["columns"]]
+            index_group = self._group.create_group("_index")
+            self._index_datasets = [index_group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=index_dtype, 
+                                                               chunks=(_CHUNK_BYTES // index_dtype.itemsize,)) 
+                                    for name in self._group.attrs["index_names"]]
+        except Exception:
+            if h5_key in self._file:
+                del self._file[h5_key]
+            self._file.close()
+            raise
+        self._buffer = np.empty((buffer_rows, len(data_column_names)), dtype=dtype)
+        self._index_buffer = np.empty((buffer_rows, len(index_names)), dtype=index_dtype)
+        self._buffered = 0
+        self._flushed = time.time()
+    
+    def write_row(self, row: np.ndarray, index_values):
+        """Adds a single row of data.
+
+        Args:
+            row (np.ndarray): Data of the row, with one value per data column.
+            index_values (tuple): Values of the sweep axes at this row, or a single value for a 1d sweep.
+        """
+        self._buffer[self._buffered] = row
+        self._index_buffer[self._buffered] = index_values
+        self._buffered += 1
+        
+        if self._buffered == len(self._buffer):
+            self._write_buffer()
+    
+    def _write_buffer(self):
+        """Writes the buffered rows and index values to disk with a single write per column."""
+        n = self._datasets[0].shape[0]
+        columns = [(dataset, self._buffer[:self._buffered, j]) for j, dataset in enumerate(self._datasets)]
+        columns += [(dataset, self._index_buffer[:self._buffered, k]) for k, dataset in enumerate(self._index_datasets)]
+        for dataset, values in columns:
+            dataset.resize((n + self._buffered,))
+            dataset[n:] = values
+        self._buffered = 0
+        # Make the written rows readable from disk, also if the writer is never closed. Not after every buffer, since 
+        # every flush compresses the partly filled chunks again.
+        if time.time() - self._flushed >= 1:
+            self._file.flush()
+            self._flushed = time.time()
+    
+    def close(self):
+        """Writes the remaining rows and closes the file."""
+        if not self._file:
+            return
+        
+        self._write_buffer()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
 def save_dict(filepath: str, data_dict : dict, h5_key: str="dictionary", mode: str='append'):
     """Saves a dictionary to an h5 file. If mode = 'append' this function points to append_dict
+    Each dictionary is stored as the attributes of an entry h5_key/entries/<i>, which is much lighter than writing a 
+    table for a handful of settings. Use `open_file` to read all entries back as a DataFrame.
 
     Args:
         filepath (str): Filepath with h5 extension.
@@ -110,21 +819,27 @@ def save_dict(filepath: str, data_dict : dict, h5_key: str="dictionary", mode: s
         h5_key (str, optional): h5 key. Defaults to "dictionary".
         mode (str, optional): If mode = 'append' this function points to append_dict. Defaults to 'append'.
     """
-    df = pd.DataFrame([data_dict])
-    keys = get_keys(filepath)
-        
-    if h5_key in keys:
-        if mode == 'append':
+    # Convert before anything is created, such that an unsupported value does not leave an empty key behind
+    record = _to_attrs(data_dict)
+    flush(filepath)
+    
+    with with_file(filepath, mode='a') as f:
+        if h5_key not in f:
+            group = f.create_group(h5_key)
+            group.attrs["layout"] = "dict"
+            try:
+                _append_entry(group, record)
+            except Exception:
+                del f[h5_key]
+                raise
+        elif mode == 'append':
             append_dict(filepath, data_dict, h5_key=h5_key)
         else:
             print("h5_key already exists, data not saved!")
-    else:
-        df.to_hdf(filepath, key=h5_key, mode='a')
-    
-
 
 def append_dict(filepath: str, data_dict : dict, h5_key: str="dictionary"):
-    """Append a dictionary to an existing h5_key in an h5 file located in filepath.
+    """Append a dictionary to an existing h5_key in an h5 file located in filepath. Like `append_nd_sweep`, the dictionary 
+    is buffered in memory until `flush` is called, which happens automatically every 100 appends.
 
     Args:
         filepath (str): Filepath with h5 extension.
@@ -132,42 +847,136 @@ def append_dict(filepath: str, data_dict : dict, h5_key: str="dictionary"):
         h5_key (str, optional): key name of the existing h5_key. Defaults to "dictionary".
     """
     
-    df = open_file(filepath=filepath, h5_key=h5_key)
-    df2 = pd.DataFrame([data_dict])
+    # Converted (and thereby copied) now, since data_dict may be changed by the caller before it is written
+    record = _to_attrs(data_dict)
+    records = _pending_dicts.setdefault((filepath, h5_key), [])
+    records.append(record)
     
-    new_df = pd.concat([df, df2], ignore_index=True)
-    new_df.to_hdf(filepath, key=h5_key, mode='a')
+    if len(records) >= _FLUSH_APPENDS:
+        flush(filepath)
+
+def _to_attrs(data_dict: dict):
+    """Converts the values of a dictionary to values that can be stored as h5 attributes. Numbers, strings, booleans and 
+    arrays of these are stored as they are. Other values (e.g. None, datetimes or nested dictionaries) are pickled, 
+    like pandas does for object columns, and restored by `_read_dict`.
+
+    Args:
+        data_dict (dict): Dictionary to be saved
+
+    Returns:
+        dict: Copy of data_dict with h5 attribute values.
+    """
+    attrs = {}
+    for key, value in data_dict.items():
+        try:
+            kind = np.asarray(value).dtype.kind
+        except ValueError:
+            # Ragged nested lists
+            kind = "O"
+        attrs[str(key)] = np.void(pickle.dumps(value)) if kind in "OMmV" else value
+    return attrs
+
+def _append_entry(group, data_dict: dict):
+    """Adds a dictionary as a new entry to a group created by `save_dict`. The entry is removed again if writing fails.
+
+    Args:
+        group (h5py.Group): Group of the dictionary
+        data_dict (dict): Dictionary converted by `_to_attrs`
+    """
+    entries = group.require_group("entries")
+    name = str(len(entries))
+    # Keep the attributes in the order of the dictionary instead of the alphabetical order
+    entry = entries.create_group(name, track_order=True)
+    try:
+        entry.attrs.update(data_dict)
+    except Exception:
+        del entries[name]
+        raise
+
+def _read_dict(group):
+    """Reads all entries of a group created by `save_dict` into a DataFrame with one row per entry.
+
+    Args:
+        group (h5py.Group): Group of the dictionary
+
+    Returns:
+        Dataframe Object: Pandas DataFrame object
+    """
+    entries = group["entries"]
+    records = [{key: pickle.loads(value.tobytes()) if isinstance(value, np.void) else value 
+                for key, value in entries[str(i)].attrs.items()} for i in range(len(entries))]
+    return pd.DataFrame.from_records(records)
     
-def open_file(filepath: str, h5_key: str = "2dsweep"):
-    """Opens a file and returns the pandas DataFrame object
+def open_file(filepath: str, h5_key: str = "2dsweep", columns: list = None):
+    """Opens a file and returns the pandas DataFrame object. Keys may be saved by `save_nd_sweep` (one dataset per column), 
+    `save_dict` (one row per dictionary) or by pandas in the 'fixed' or 'table' format. Zarr stores written with 
+    backend = 'zarr' are opened by passing their path with the .zarr extension.
 
     Args:
-        filepath (str): Filepath with h5 extension.
+        filepath (str): Filepath with h5 or zarr extension.
         h5_key (str, optional): h5 key. Defaults to "2dsweep".
+        columns (list, optional): Only return these data columns. For keys saved by `save_nd_sweep`, the other columns 
+        are not read from disk. If None, all columns are returned. Defaults to None.
 
     Returns:
         Dataframe Object: Pandas DataFrame object
     """
-    if h5_key in get_keys(filepath):
-        return pd.read_hdf(filepath, key=h5_key)
+    flush(filepath)
+    
+    with with_file(filepath) as f:
+        keys = [] if f is None else get_keys(filepath, f)
+        if h5_key in keys and f[h5_key].attrs.get("layout") == "columns":
+            return _read_columns(f[h5_key], columns=columns)
+        elif h5_key in keys and f[h5_key].attrs.get("layout") == "dict":
+            df = _read_dict(f[h5_key])
+            return df if columns is None else df[columns]
+    
+    if h5_key in keys:
+        with pd.HDFStore(filepath, mode='r') as store:
+            df = store[h5_key]
+        return df if columns is None else df[columns]
     else:
         print(f"h5_key {h5_key} does not exist! These are all available h5_keys:")
-        print(get_keys(filepath))
+        print(keys)
+
+@contextmanager
+def with_file(filepath: str, mode: str = 'r'):
+    """Opens an h5 file once, such that the handle can be shared between checking keys, reading and writing.
+    Zarr stores (.zarr extension) are opened as a zarr group, which can be used the same way.
+
+    Args:
+        filepath (str): Filepath with h5 or zarr extension.
+        mode (str, optional): h5py file mode. Defaults to 'r'.
+
+    Yields:
+        h5py.File or zarr.Group: Open file handle, or None if mode = 'r' and the file does not exist.
+    """
+    if mode == 'r' and not os.path.exists(filepath):
+        yield None
+    elif _is_zarr(filepath):
+        if zarr is None:
+            raise ImportError("The zarr package is required for zarr stores.")
+        yield zarr.open_group(filepath, mode=mode)
+    else:
+        with h5py.File(filepath, mode) as f:
+            yield f
 
-def get_keys(filepath: str):
+def get_keys(filepath: str, f: h5py.File = None):
     """Lists the keys in an h5 file. Handy for checking if a key exists.
 
     Args:
         filepath (str): Filepath with h5 extension.
+        f (h5py.File, optional): Already opened file handle, see `with_file`. The file is not opened again if this is given. Defaults to None.
 
     Returns:
         List: list of keys.
     """
-    if os.path.exists(filepath):
-        # Read if the chosen key already exists:
-        with h5py.File(filepath, "r") as f:
-            keys = list(f.keys())
-    else:
-        keys = []
+    if f is not None:
+        return sorted(f.keys())
+    
+    flush(filepath)
+    
+    with with_file(filepath) as f:
+        keys = [] if f is None else sorted(f.keys())
     
-    return keys
\ No newline at end of file
+    return keys